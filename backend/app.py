@@ -1,21 +1,49 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
+from flask.json.provider import JSONProvider
+from flask_caching import Cache
 from flask_migrate import Migrate
 from flask_cors import CORS
 import os
+import threading
+import redis
+import numpy as np
+from numpy.lib.recfunctions import structured_to_unstructured
+import orjson
 import pandas as pd
 import joblib
+from sqlalchemy import insert, select
 
 # 新しく作成したスクレイパーから関数をインポート
-from race_card_scraper import scrape_race_card, preprocess_for_prediction
+from race_card_scraper import (
+    MODEL_FEATURES,
+    scrape_race_card,
+    preprocess_for_prediction,
+)
 
 # モデル定義を分離した`models.py`からdbオブジェクトと必要なモデルをインポート
 from models import db, Race
 
 
+class ORJSONProvider(JSONProvider):
+    """
+    jsonify() のJSON変換に、高速なライブラリ orjson を使うためのクラス
+    orjsonは日本語をそのままUTF-8で出力するので、文字化け対策の設定も不要になる
+    """
+
+    # NumPyの数値や配列、文字列以外の辞書キーもそのまま変換できるようにする
+    option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 # Flaskアプリケーションのインスタンスを作成
 app = Flask(__name__)
-# 日本語がJSONで文字化けしないように設定
-app.config["JSON_AS_ASCII"] = False
+# JSONの変換処理を orjson を使うものに差し替える
+app.json = ORJSONProvider(app)
 
 # データベース接続設定
 # postgresql://<ユーザー名>:<パスワード>@<ホスト>:<ポート>/<データベース名>
@@ -24,6 +52,21 @@ app.config["SQLALCHEMY_DATABASE_URI"] = (
 )
 # SQLAlchemyがデータベースの変更を追跡する機能を無効にする（パフォーマンス向上のため）
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# コネクションプールの設定
+# 接続を毎回作り直さずに使い回すことで、同時アクセスが多いときの待ち時間を減らす
+# ※ ワーカー数 × (pool_size + max_overflow) が PostgreSQL の max_connections を
+#    超えないように調整すること
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+    "pool_size": 10,  # 常に保持しておく接続の数
+    "max_overflow": 20,  # 混雑時に一時的に追加で作れる接続の数
+    "pool_timeout": 30,  # 空き接続を待つ最大秒数
+    # 30分使った接続は作り直す（DBやクラウド側のアイドル切断より先に入れ替える）
+    "pool_recycle": 1800,
+    # 使う前に "SELECT 1" で接続が生きているか確認し、切れていれば自動で張り直す
+    # PgBouncerのトランザクションモード経由の場合は DB_POOL_PRE_PING=0 で無効にする
+    "pool_pre_ping": os.environ.get("DB_POOL_PRE_PING", "1") != "0",
+    "isolation_level": "READ COMMITTED",  # トランザクション分離レベルを明示
+}
 
 # CORSを有効にする。これにより、異なるオリジン（http://localhost:3000）からのリクエストを受け入れる
 CORS(app)
@@ -42,24 +85,109 @@ MODEL_PATH = os.path.join(BASE_DIR, "race_prediction_model.pkl")
 
 # モデルの存在チェック
 if os.path.exists(MODEL_PATH):
-    model = joblib.load(MODEL_PATH)
+    # mmap_mode="r" でモデル内の配列をメモリマップとして読み込む
+    # gunicornの preload_app と組み合わせると、複数のワーカーが同じメモリを共有できる
+    model = joblib.load(MODEL_PATH, mmap_mode="r")
     print(f" * AI model loaded from {MODEL_PATH}")
-    # 訓練時に使用した特徴量の順番を定義
-    model_features = [
-        "waku",
-        "umaban",
-        "jockey_weight",
-        "horse_weight",
-        "sex",
-        "age",
-        "win_rate",
-        "place_rate",
-        "show_rate",
-    ]
 else:
     model = None
     print(f" * Warning: AI model not found at {MODEL_PATH}")
 
+# ONNX形式に変換したモデルがあれば、高速な推論エンジン ONNX Runtime で予測する
+# (train_model.py がモデルと一緒に書き出す。なければscikit-learnのモデルをそのまま使う)
+ONNX_MODEL_PATH = os.path.join(BASE_DIR, "race_prediction_model.onnx")
+use_onnx = False
+if model is not None and os.path.exists(ONNX_MODEL_PATH):
+    try:
+        import onnxruntime
+    except ImportError:
+        print(" * Warning: onnxruntime is not installed, using scikit-learn model")
+    else:
+        use_onnx = True
+
+# ONNX Runtimeのセッションは内部のスレッドプールがforkを越えて使えないので、
+# gunicornの preload_app で親プロセスが読み込むときには作らず、
+# 各ワーカーで最初に予測するときに作る (複数スレッドから呼ばれるのでロックする)
+_onnx_session = None
+_onnx_session_lock = threading.Lock()
+
+
+def get_onnx_session():
+    """
+    このプロセス用のONNX Runtimeのセッションを返す関数
+    ONNX形式のモデルを使わない場合はNoneを返す
+    """
+    global _onnx_session
+    if not use_onnx:
+        return None
+    with _onnx_session_lock:
+        if _onnx_session is None:
+            _onnx_session = onnxruntime.InferenceSession(
+                ONNX_MODEL_PATH, providers=["CPUExecutionProvider"]
+            )
+            print(f" * ONNX model loaded from {ONNX_MODEL_PATH} (pid {os.getpid()})")
+    return _onnx_session
+
+
+def predict_show_probabilities(X: np.ndarray) -> np.ndarray:
+    """
+    特徴量の配列を受け取り、各馬が3着以内に入る確率を返す関数
+    Xは MODEL_FEATURES の順番に並んだ float32 の連続した配列を想定している
+    (float32にすることで、予測時にモデルが読み込むデータ量が半分になる)
+    """
+    onnx_session = get_onnx_session()
+    if onnx_session is not None:
+        # ONNX Runtimeは "probabilities" に [[クラス0の確率, クラス1の確率], ...] を返す
+        # float32 のままだとJSONが 12.350000381469727 のようになるので float64 にする
+        probabilities = onnx_session.run(["probabilities"], {"X": X})[0]
+        return probabilities[:, 1].astype(np.float64)
+
+    # モデルは列名付きで学習しているので、配列をコピーせずに列名だけ付ける
+    input_df = pd.DataFrame(X, columns=MODEL_FEATURES, copy=False)
+    # predict_probaは [[クラス0の確率, クラス1の確率], ...] という形式で返す
+    return model.predict_proba(input_df)[:, 1]
+
+
+# ============================================
+# Redisキャッシュの設定
+# ============================================
+# 同じURLへの予測結果を一時的に保存し、再スクレイピングを避けるために使う
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+# 予測結果をキャッシュしておく秒数（10分）
+PREDICTION_CACHE_TTL = 600
+# Redisが起動していなくてもAPIが長時間止まらないように、タイムアウトを短くする
+redis_client = redis.Redis.from_url(
+    REDIS_URL, socket_connect_timeout=1, socket_timeout=1
+)
+
+# あまり変わらないレース一覧などのAPIレスポンスを、Flask-Cachingで同じRedisに保存する
+# キャッシュしておく秒数（5分）
+RACES_CACHE_TIMEOUT = 300
+
+
+def get_cache_type():
+    """
+    Redisに接続できるか確かめて、Flask-Cachingで使うキャッシュの種類を返す関数
+    デバッグモードのFlask-CachingはRedisのエラーをそのまま投げてしまうので、
+    Redisが起動していない開発環境では、何も保存しない NullCache を使う
+    """
+    try:
+        redis_client.ping()
+    except redis.exceptions.RedisError as e:
+        print(f" * Warning: Redis is not available, API responses are not cached: {e}")
+        return "NullCache"
+    return "RedisCache"
+
+
+cache = Cache(
+    app,
+    config={
+        "CACHE_TYPE": get_cache_type(),
+        "CACHE_REDIS_URL": REDIS_URL,
+        "CACHE_OPTIONS": {"socket_connect_timeout": 1, "socket_timeout": 1},
+    },
+)
+
 
 # ============================================
 # APIエンドポイント
@@ -77,13 +205,22 @@ def hello_world():
 
 # http://127.0.0.1:5000/api/races というURLにアクセスがあったときに実行される関数
 @app.route("/api/races")
+@cache.cached(timeout=RACES_CACHE_TIMEOUT)
 def get_races():
     # データベースからすべてのレース情報を取得
-    races = Race.query.all()
-    # 取得したレースオブジェクトのリストを、辞書のリストに変換
-    races_list = [race.to_dict() for race in races]
+    # 一覧表示に必要なカラムだけを選び、モデルオブジェクトを作らずに
+    # 「カラム名: 値」の辞書のような形(mappings)で受け取る
+    rows = db.session.execute(
+        select(Race.id, Race.name, Race.venue, Race.date)
+    ).mappings()
+    # 日付を文字列に変換して、辞書のリストにする
+    races_list = [{**row, "date": row["date"].strftime("%Y-%m-%d")} for row in rows]
     # JSON形式でレースリストを返す
-    return jsonify(races_list)
+    response = jsonify(races_list)
+    # ブラウザやCDNにも同じ時間だけレスポンスをキャッシュしてもらう
+    response.cache_control.public = True
+    response.cache_control.max_age = RACES_CACHE_TIMEOUT
+    return response
 
 
 @app.route("/api/predict", methods=["POST"])
@@ -105,28 +242,23 @@ def predict():
         return jsonify({"error": "Missing 'horses' data"}), 400
 
     try:
-        # 受け取ったデータをpandas DataFrameに変換
-        input_df = pd.DataFrame(horses_data)
-
-        # モデルが学習した際の特徴量の順番にカラムを並び替える
+        # 受け取ったデータを、モデルが学習した際の特徴量の順番で数値の配列に変換
         # これにより、リクエストのJSONの順番が違っても正しく予測できる
-        input_df_reordered = input_df[model_features]
+        X = np.asarray(
+            [[horse[key] for key in MODEL_FEATURES] for horse in horses_data],
+            dtype=np.float32,
+        )
 
         # 予測の実行（3着以内に入る確率を予測）
-        # predict_probaは [[クラス0の確率, クラス1の確率], ...] という形式で返す
-        probabilities = model.predict_proba(input_df_reordered)[:, 1]
+        probabilities = predict_show_probabilities(X)
 
         # 予測結果を整形
-        predictions = []
-        for i, horse in enumerate(horses_data):
-            predictions.append(
-                {
-                    "umaban": horse.get("umaban"),
-                    "probability": round(
-                        probabilities[i] * 100, 2
-                    ),  # %に変換して四捨五入
-                }
-            )
+        # %への変換と四捨五入は、NumPyで全馬分をまとめて計算する
+        probs = np.round(probabilities * 100.0, 2).tolist()
+        predictions = [
+            {"umaban": horse.get("umaban"), "probability": prob}
+            for horse, prob in zip(horses_data, probs)
+        ]
 
         return jsonify({"predictions": predictions})
 
@@ -153,39 +285,59 @@ def predict_from_url():
     if not url:
         return jsonify({"error": "Missing 'url' parameter"}), 400
 
+    # 同じURLの予測結果がキャッシュにあれば、スクレイピングせずにそれを返す
+    cache_key = f"pred:{url}"
+    try:
+        cached = redis_client.get(cache_key)
+    except redis.exceptions.RedisError as e:
+        # Redisに接続できない場合はキャッシュを使わずに処理を続ける
+        print(f"キャッシュの取得に失敗しました: {e}")
+        cached = None
+    if cached:
+        return Response(cached, mimetype="application/json")
+
     try:
         # 1. URLから出馬表をスクレイピング
         print(f"スクレイピングを開始します: {url}")
-        raw_df = scrape_race_card(url)
+        horses = scrape_race_card(url)
 
-        if raw_df.empty:
+        if not horses:
             return jsonify({"error": "出馬表データの取得に失敗しました。"}), 404
 
         # 2. 予測用にデータを前処理
-        input_df = preprocess_for_prediction(raw_df)
+        # リクエスト処理中なので、そのままFlask-SQLAlchemyのセッションを渡す
+        features = preprocess_for_prediction(horses, db.session)
 
-        if input_df.empty:
+        if len(features) == 0:
             return jsonify({"error": "予測可能な馬がいません（データ不足など）。"}), 400
 
-        # モデルが学習した特徴量の順番にカラムを並び替える
-        input_df_reordered = input_df[model_features]
+        # モデルが学習した特徴量の順番に並べ、float32の連続した配列に変換する
+        X = np.ascontiguousarray(
+            structured_to_unstructured(features[list(MODEL_FEATURES)], np.float32)
+        )
 
         # 3. 予測の実行
-        probabilities = model.predict_proba(input_df_reordered)[:, 1]
+        probabilities = predict_show_probabilities(X)
 
         # 4. 予測結果を整形
-        predictions = []
-        # input_dfにはumabanカラムがあるので、それを利用する
-        for index, row in input_df.iterrows():
-            predictions.append(
-                {
-                    "umaban": int(row["umaban"]),
-                    "probability": round(probabilities[index] * 100, 2),
-                }
-            )
+        # featuresにはumaban列があるので、それを列ごと取り出して確率と並べる
+        umabans = features["umaban"].tolist()
+        probs = np.round(probabilities * 100.0, 2).tolist()
+        predictions = [
+            {"umaban": umaban, "probability": prob}
+            for umaban, prob in zip(umabans, probs)
+        ]
 
         print("予測が完了しました。")
-        return jsonify({"predictions": predictions})
+        response = jsonify({"predictions": predictions})
+
+        # 予測結果をキャッシュに保存しておく
+        try:
+            redis_client.setex(cache_key, PREDICTION_CACHE_TTL, response.get_data())
+        except redis.exceptions.RedisError as e:
+            print(f"キャッシュの保存に失敗しました: {e}")
+
+        return response
 
     except Exception as e:
         # エラーハンドリング
@@ -201,21 +353,28 @@ def seed_db():
     # 既存のデータをすべて削除
     Race.query.delete()
 
-    # 初期データの作成
+    # 初期データの作成（モデルオブジェクトではなく、カラム名と値の辞書で用意する）
     races_to_seed = [
-        Race(name="皐月賞", venue="中山競馬場", date=date(2024, 4, 14)),
-        Race(name="天皇賞（春）", venue="京都競馬場", date=date(2024, 4, 28)),
-        Race(name="日本ダービー", venue="東京競馬場", date=date(2024, 5, 26)),
+        {"name": "皐月賞", "venue": "中山競馬場", "date": date(2024, 4, 14)},
+        {"name": "天皇賞（春）", "venue": "京都競馬場", "date": date(2024, 4, 28)},
+        {"name": "日本ダービー", "venue": "東京競馬場", "date": date(2024, 5, 26)},
     ]
 
-    # データベースセッションにデータを追加
-    db.session.bulk_save_objects(races_to_seed)
+    # INSERT文を1つ作り、全データをまとめて(executemanyで)データベースに追加
+    db.session.execute(insert(Race), races_to_seed)
     # 変更をコミット（確定）
     db.session.commit()
+    # レース一覧が変わったので、キャッシュしておいたレスポンスを削除する
+    # (データはコミット済みなので、Redisに接続できなくても失敗扱いにはしない)
+    try:
+        cache.delete("view//api/races")
+    except redis.exceptions.RedisError as e:
+        print(f"レース一覧のキャッシュを削除できませんでした: {e}")
     print("データベースに初期データを投入しました。")
 
 
-# このファイルが直接実行された場合にサーバーを起動する
+# このファイルが直接実行された場合に開発用サーバーを起動する
+# 本番環境では `gunicorn app:app` で起動する（設定は gunicorn.conf.py を参照）
 if __name__ == "__main__":
     # デバッグモードでサーバーを起動
     # これにより、コードを変更したときに自動でサーバーが再起動されるようになります
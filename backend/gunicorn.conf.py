@@ -0,0 +1,25 @@
+# Gunicorn（本番用のWSGIサーバー）の設定ファイル
+# backendディレクトリで次のコマンドを実行すると、この設定が自動で読み込まれる
+#   gunicorn app:app
+import multiprocessing
+import os
+
+# 待ち受けるアドレスとポート
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+
+# ワーカー（リクエストを処理するプロセス）の数
+# CPUコア数と同じだけ起動して、予測処理を並列に実行できるようにする
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+
+# 各ワーカーの中でスレッドを使い、スクレイピング待ちの間も別のリクエストを処理する
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+# 一定回数リクエストを処理したワーカーを作り直し、メモリの増加を防ぐ
+# jitterでワーカーごとにタイミングをずらし、全員が同時に再起動しないようにする
+max_requests = 1000
+max_requests_jitter = 100
+
+# ワーカーを起動する前に親プロセスでアプリ(とAIモデル)を1回だけ読み込む
+# 読み込んだモデルはforkしたワーカー間で共有されるので、メモリ使用量と起動時間を減らせる
+preload_app = True
@@ -17,7 +17,8 @@ class Race(db.Model):
     date = db.Column(db.Date, nullable=False)  # 開催日（日付型、NULL不可）
 
     # Raceモデルから関連するResultを簡単に参照できるようにするための設定
-    results = db.relationship("Result", backref="race", lazy=True)
+    # 反対側(Result.race)も明示的に定義し、back_populatesで結び付ける
+    results = db.relationship("Result", back_populates="race", lazy=True)
 
     def to_dict(self):
         return {
@@ -31,8 +32,24 @@ class Race(db.Model):
         return f"<Race {self.name}>"
 
 
+# レース結果の整数の列を、pandasで扱うときの型 (スクレイパーと訓練で共通)
+# int64 のままだと必要以上にメモリを使うので、値の範囲に合った小さい型にする
+# (小数の列はデータベースに保存するときに誤差が出ないよう、float64 のままにする)
+RESULT_DTYPES = {
+    "rank": "int8",
+    "waku": "int8",
+    "umaban": "int8",
+    "popular": "int16",
+    "horse_weight": "int16",
+}
+
+
 class Result(db.Model):
     __tablename__ = "results"
+    # レースごとの着順で検索・並び替えするための複合インデックス
+    # (先頭が race_id なので、race_id だけでの検索にもこのインデックスが使われる)
+    __table_args__ = (db.Index("ix_results_race_rank", "race_id", "rank"),)
+
     id = db.Column(db.Integer, primary_key=True)
     rank = db.Column(db.Integer, nullable=False)
     waku = db.Column(db.Integer, nullable=False)
@@ -44,9 +61,21 @@ class Result(db.Model):
     horse_weight = db.Column(db.Integer, nullable=False)
 
     # 外部キーの設定
+    # race_id は ix_results_race_rank (race_id, rank) の先頭の列なので、
+    # そのインデックスで検索できる (別にインデックスを作る必要はない)
     race_id = db.Column(db.String(20), db.ForeignKey("races.id"), nullable=False)
-    horse_id = db.Column(db.Integer, db.ForeignKey("horses.id"), nullable=False)
-    jockey_id = db.Column(db.Integer, db.ForeignKey("jockeys.id"), nullable=False)
+    # PostgreSQLは外部キーに自動でインデックスを作らないので、index=Trueで明示する
+    horse_id = db.Column(
+        db.Integer, db.ForeignKey("horses.id"), nullable=False, index=True
+    )
+    jockey_id = db.Column(
+        db.Integer, db.ForeignKey("jockeys.id"), nullable=False, index=True
+    )
+
+    # 関連するレース・馬・騎手を参照するための設定
+    race = db.relationship("Race", back_populates="results")
+    horse = db.relationship("Horse", back_populates="results")
+    jockey = db.relationship("Jockey", back_populates="results")
 
     def __repr__(self):
         return f"<Result {self.id}>"
@@ -56,7 +85,7 @@ class Horse(db.Model):
     __tablename__ = "horses"
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
-    results = db.relationship("Result", backref="horse", lazy=True)
+    results = db.relationship("Result", back_populates="horse", lazy=True)
 
     def __repr__(self):
         return f"<Horse {self.name}>"
@@ -72,7 +101,7 @@ class Jockey(db.Model):
     place_rate = db.Column(db.Float, nullable=True)  # 連対率
     show_rate = db.Column(db.Float, nullable=True)  # 複勝率
 
-    results = db.relationship("Result", backref="jockey", lazy=True)
+    results = db.relationship("Result", back_populates="jockey", lazy=True)
 
     def __repr__(self):
         return f"<Jockey {self.name}>"
@@ -1,33 +1,151 @@
 import re
+import threading
 import time
-import pandas as pd
+import numpy as np
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from requests.adapters import HTTPAdapter
+from sqlalchemy import select
+from sqlalchemy.orm import Session
 
 # JockeyモデルをインポートしてDBにアクセスできるようにする
-from models import Jockey
+from models import db, Jockey
+
+# 訓練時・予測時に使用する特徴量（モデルに渡す列の順番もこの通り）
+# リクエストのたびに作り直さないよう、変更できないタプルとして1回だけ定義する
+MODEL_FEATURES = (
+    "waku",
+    "umaban",
+    "jockey_weight",
+    "horse_weight",
+    "sex",
+    "age",
+    "win_rate",
+    "place_rate",
+    "show_rate",
+)
+
+# 予測用の構造化配列(numpy)で使う、各特徴量の型
+# 列の順番は MODEL_FEATURES と同じにする
+PREDICTION_DTYPE = np.dtype(
+    [
+        ("waku", np.int32),
+        ("umaban", np.int32),
+        ("jockey_weight", np.float32),
+        ("horse_weight", np.int32),
+        ("sex", np.int32),
+        ("age", np.int32),
+        ("win_rate", np.float32),
+        ("place_rate", np.float32),
+        ("show_rate", np.float32),
+    ]
+)
+
+# 出馬表から読み取る特徴量 (騎手の成績以外)。1つでも None の馬は予測に使えない
+_SCRAPED_FEATURES = ("waku", "umaban", "jockey_weight", "horse_weight", "sex", "age")
+
+# 'sex' を数値にエンコードするための対応表 (牡=0, 牝=1, セ=2)
+SEX_MAP = {"牡": 0, "牝": 1, "セ": 2}
+
+# netkeibaへのリクエストの最小間隔（秒）
+REQUEST_INTERVAL = 1.0
+# 接続待ち・読み込み待ちのタイムアウト（秒）
+REQUEST_TIMEOUT = (3, 10)
+
+# 繰り返し使う正規表現は、あらかじめコンパイルしておく
+# 騎手ページへのリンクから騎手IDを取り出す
+_JOCKEY_RE = re.compile(r"/jockey/result/recent/(\d+)/")
+# "480(+2)" のような文字列の先頭から馬体重(3桁)を取り出す
+_WEIGHT_RE = re.compile(r"^(\d{3})")
+# "牡4" のような文字列を性別("牡")と年齢("4")に分ける
+_SEX_AGE_RE = re.compile(r"^(.)(\d+)")
+
+# 出馬表のテーブル(<table class="RaceTable01">)だけを解析するための条件
+# ページ全体の木構造を作らずに済むので、解析が速くなる
+# (実際のテーブルは class="Shutuba_Table RaceTable01 ShutubaTable" のように
+#  複数のクラスを持つので、正規表現で RaceTable01 を含むかを調べる)
+_RACE_CARD_STRAINER = SoupStrainer("table", class_=re.compile(r"\bRaceTable01\b"))
+
+# HTTPセッションをモジュールで1つだけ作って使い回す
+# 同じサーバーへの接続（TCP/TLS）が再利用されるので、2回目以降のリクエストが速くなる
+_session = requests.Session()
+_session.mount(
+    "https://", HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=3)
+)
+_session.headers.update(
+    {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
+)
+
+# 最後にリクエストを送った時刻と、それを複数スレッドから安全に扱うためのロック
+_last_request_time = 0.0
+_request_lock = threading.Lock()
+
+
+def _wait_for_request_slot():
+    """
+    前回のリクエストから REQUEST_INTERVAL 秒以上空くまで待機する関数
+    間隔が十分空いていれば待たずにすぐ戻るので、毎回1秒止まることはない
+    (netkeibaへの負荷を抑えるため、1つのワーカーからは意図して1秒に1回までにしている)
+    """
+    global _last_request_time
+    # ロックの中では自分の送信時刻を予約するだけにして、待つのはロックを外してから行う
+    # (ロックを持ったまま眠ると、他のスレッドは予約すらできずに並んで待つことになる)
+    with _request_lock:
+        now = time.monotonic()
+        slot = max(now, _last_request_time + REQUEST_INTERVAL)
+        _last_request_time = slot
+    wait = slot - now
+    if wait > 0:
+        time.sleep(wait)
+
+
+def _to_int(text: str) -> int | None:
+    """
+    文字列を整数に変換する関数。変換できない場合は None を返す
+    """
+    try:
+        return int(text)
+    except ValueError:
+        return None
+
+
+def _to_float(text: str) -> float | None:
+    """
+    文字列を小数に変換する関数。変換できない場合は None を返す
+    """
+    try:
+        return float(text)
+    except ValueError:
+        return None
 
 
-def scrape_race_card(url: str) -> pd.DataFrame:
+def scrape_race_card(url: str) -> list[dict]:
     """
     指定されたnetkeibaの出馬表URLから馬のリストをスクレイピングし、
-    DataFrameとして返す関数
+    1頭分のデータを1つの辞書にしたリストとして返す関数
+    数値の項目は、この時点で int / float に変換しておく (読み取れない値は None)
     """
-    # サイトに負荷をかけないように待機
-    time.sleep(1)
+    # サイトに負荷をかけないように、前回のリクエストから間隔を空ける
+    _wait_for_request_slot()
 
     try:
-        response = requests.get(url)
-        # 文字化けを防ぐ
-        response.encoding = response.apparent_encoding
-
-        soup = BeautifulSoup(response.text, "html.parser")
+        response = _session.get(url, timeout=REQUEST_TIMEOUT)
+
+        # C言語で実装された高速なlxmlパーサーでHTMLを解析する
+        # netkeibaのページは常にEUC-JPなので、文字コードを指定して判定処理を省く
+        # (response.apparent_encoding はページ全体を走査するので遅い)
+        soup = BeautifulSoup(
+            response.content,
+            "lxml",
+            from_encoding="euc-jp",
+            parse_only=_RACE_CARD_STRAINER,
+        )
 
         # 出馬表のテーブルを取得
         table = soup.find("table", class_="RaceTable01")
         if table is None:
             print("エラー: 出馬表のテーブルが見つかりませんでした。")
-            return pd.DataFrame()
+            return []
 
         rows = table.find_all("tr", class_="HorseList")
 
@@ -42,132 +160,87 @@ def scrape_race_card(url: str) -> pd.DataFrame:
             # 騎手IDをaタグのhrefから抽出
             jockey_link = cols[6].find("a")
             jockey_id_match = (
-                re.search(r"/jockey/result/recent/(\d+)/", jockey_link["href"])
-                if jockey_link
-                else None
+                _JOCKEY_RE.search(jockey_link["href"]) if jockey_link else None
             )
-            jockey_id = jockey_id_match.group(1) if jockey_id_match else None
+            jockey_id = int(jockey_id_match.group(1)) if jockey_id_match else None
+
+            # "480(+2)" から馬体重を、"牡4" から性別と年齢を取り出す
+            # "計不" (計測不能) や発表前などで取り出せない値は None にしておく
+            # (馬体重の発表前でも出馬表は取れているので、ここでは馬を除かず、
+            #  予測に使えるかどうかは preprocess_for_prediction で判定する)
+            weight_match = _WEIGHT_RE.match(cols[8].text.strip())
+            sex_age_match = _SEX_AGE_RE.match(cols[4].text.strip())
 
             horse_data = {
-                "waku": cols[0].text.strip(),
-                "umaban": cols[1].text.strip(),
-                "sex_age": cols[4].text.strip(),
-                "jockey_weight": cols[5].text.strip(),
+                "waku": _to_int(cols[0].text.strip()),
+                "umaban": _to_int(cols[1].text.strip()),
+                # 'sex' はこの時点で数値にエンコードしておく (牡=0, 牝=1, セ=2)
+                "sex": SEX_MAP.get(sex_age_match.group(1)) if sex_age_match else None,
+                "age": int(sex_age_match.group(2)) if sex_age_match else None,
+                "jockey_weight": _to_float(cols[5].text.strip()),
                 "jockey_id": jockey_id,  # 騎手IDを追加
-                "horse_weight_info": cols[8].text.strip(),
+                "horse_weight": int(weight_match.group(1)) if weight_match else None,
             }
             horse_list.append(horse_data)
 
-        return pd.DataFrame(horse_list)
+        return horse_list
 
     except requests.exceptions.RequestException as e:
         print(f"HTTPリクエストエラー: {e}")
-        return pd.DataFrame()
+        return []
 
 
-def preprocess_for_prediction(df: pd.DataFrame) -> pd.DataFrame:
+def preprocess_for_prediction(horses: list[dict], session: Session) -> np.ndarray:
     """
     スクレイピングした出馬表データをAIの予測に使える形式に前処理する関数
+    MODEL_FEATURES の列を持つnumpyの構造化配列を返す
+    騎手の成績は、呼び出し元から渡されたデータベースセッション(session)で取得する
     """
-    # 関数が呼び出されたタイミングでappをインポートする（循環インポート対策）
-    from app import app
-
-    if df.empty:
-        return df
-
-    df_processed = df.copy()
-
-    # --- 1. Jockeyの成績データを取得してマージ ---
-    with app.app_context():
-        # スクレイピング結果からユニークなjockey_idを取得
-        jockey_ids = [int(jid) for jid in df_processed["jockey_id"].unique() if jid]
-        if jockey_ids:
-            # データベースから該当騎手の成績を取得
-            jockeys = Jockey.query.filter(Jockey.id.in_(jockey_ids)).all()
-            jockey_stats = {
-                j.id: {
-                    "win_rate": j.win_rate,
-                    "place_rate": j.place_rate,
-                    "show_rate": j.show_rate,
-                }
-                for j in jockeys
-            }
-            jockey_stats_df = pd.DataFrame.from_dict(jockey_stats, orient="index")
-            jockey_stats_df.index.name = "jockey_id"
-
-            # jockey_idを数値型に変換してからマージ
-            df_processed["jockey_id"] = pd.to_numeric(
-                df_processed["jockey_id"], errors="coerce"
-            )
-            df_processed = pd.merge(
-                df_processed, jockey_stats_df, on="jockey_id", how="left"
-            )
+    # 枠番・馬体重・性別などが1つでも読み取れなかった馬は予測に使えないので除く
+    # (騎手IDがない馬は、成績を0として予測する)
+    horses = [
+        horse
+        for horse in horses
+        if all(horse[key] is not None for key in _SCRAPED_FEATURES)
+    ]
+    if not horses:
+        return np.empty(0, dtype=PREDICTION_DTYPE)
+
+    # --- 1. Jockeyの成績データを取得 ---
+    # スクレイピング結果からユニークなjockey_idを取得
+    jockey_ids = {
+        horse["jockey_id"] for horse in horses if horse["jockey_id"] is not None
+    }
+
+    stats = {}
+    if jockey_ids:
+        # データベースから該当騎手の成績だけを取得
+        # モデルオブジェクトを作らず、必要なカラムの値(タプル)だけを受け取る
+        rows = session.execute(
+            select(
+                Jockey.id, Jockey.win_rate, Jockey.place_rate, Jockey.show_rate
+            ).where(Jockey.id.in_(jockey_ids))
+        ).all()
+        # 騎手IDをキーにした辞書を作る (成績がNULLの場合は0にする)
+        stats = {row[0]: tuple(rate or 0.0 for rate in row[1:]) for row in rows}
 
     # 成績データがない騎手(新人など)は0で埋める
-    df_processed["win_rate"] = df_processed["win_rate"].fillna(0)
-    df_processed["place_rate"] = df_processed["place_rate"].fillna(0)
-    df_processed["show_rate"] = df_processed["show_rate"].fillna(0)
-
-    # 2. データ型の変換と不要な行の削除
-    df_processed["waku"] = pd.to_numeric(df_processed["waku"], errors="coerce")
-    df_processed["umaban"] = pd.to_numeric(df_processed["umaban"], errors="coerce")
-    df_processed["jockey_weight"] = pd.to_numeric(
-        df_processed["jockey_weight"], errors="coerce"
-    )
-
-    # 3. 'horse_weight_info' から馬体重を抽出
-    # "480(+2)" や "計不" (計測不能) といった形式に対応
-    def extract_weight(text):
-        match = re.search(r"^\d{3}", text)
-        return int(match.group(0)) if match else None
-
-    df_processed["horse_weight"] = df_processed["horse_weight_info"].apply(
-        extract_weight
-    )
-
-    # 4. 'sex_age' を 'sex' と 'age' に分割
-    df_processed["sex"] = df_processed["sex_age"].str[0]
-    df_processed["age"] = pd.to_numeric(
-        df_processed["sex_age"].str[1:], errors="coerce"
-    )
-
-    # 'sex' を数値にエンコード (牡=0, 牝=1, セ=2)
-    sex_map = {"牡": 0, "牝": 1, "セ": 2}
-    df_processed["sex"] = df_processed["sex"].map(sex_map)
-
-    # 5. 必要なカラムだけに絞り込み、順番をモデルに合わせる
-    model_features = [
-        "waku",
-        "umaban",
-        "jockey_weight",
-        "horse_weight",
-        "sex",
-        "age",
-        "win_rate",
-        "place_rate",
-        "show_rate",
+    no_stats = (0.0, 0.0, 0.0)
+
+    # --- 2. MODEL_FEATURES の順番に値を並べ、構造化配列を1回で作る ---
+    records = [
+        (
+            horse["waku"],
+            horse["umaban"],
+            horse["jockey_weight"],
+            horse["horse_weight"],
+            horse["sex"],
+            horse["age"],
+            *stats.get(horse["jockey_id"], no_stats),
+        )
+        for horse in horses
     ]
-    df_processed = df_processed[model_features]
-
-    # 6. 処理中に欠損値が発生した行を削除
-    df_processed = df_processed.dropna()
-
-    # 7. データ型を最終調整
-    df_processed = df_processed.astype(
-        {
-            "waku": int,
-            "umaban": int,
-            "jockey_weight": float,
-            "horse_weight": int,
-            "sex": int,
-            "age": int,
-            "win_rate": float,
-            "place_rate": float,
-            "show_rate": float,
-        }
-    )
-
-    return df_processed
+    return np.array(records, dtype=PREDICTION_DTYPE)
 
 
 def main():
@@ -181,19 +254,24 @@ def main():
     print(f"テストURLから出馬表データを取得します: {test_url}")
 
     # スクレイピング実行
-    raw_df = scrape_race_card(test_url)
+    horses = scrape_race_card(test_url)
 
-    if not raw_df.empty:
+    if horses:
         print("\n--- スクレイピング結果 (生データ) ---")
-        print(raw_df)
+        for horse in horses:
+            print(horse)
+
+        # 関数が呼び出されたタイミングでappをインポートする（循環インポート対策）
+        from app import app
 
-        # 前処理実行
-        processed_df = preprocess_for_prediction(raw_df)
+        # 前処理実行（DBにアクセスするため、アプリケーションコンテキスト内で行う）
+        with app.app_context():
+            features = preprocess_for_prediction(horses, db.session)
 
         print("\n--- AI予測用の前処理済みデータ ---")
-        print(processed_df)
+        print(features)
         print("\nカラムのデータ型:")
-        print(processed_df.dtypes)
+        print(features.dtype)
     else:
         print("データを取得できませんでした。")
 
@@ -1,13 +1,120 @@
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import pandas as pd
+import itertools
+import os
+import threading
 import time
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from tqdm import tqdm
-from datetime import datetime
+from datetime import datetime, timedelta
 import re
+from html import unescape
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from requests_cache import CachedSession
+from selectolax.lexbor import LexborHTMLParser
+from sqlalchemy import insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 # Flaskアプリケーションのコンテキストをインポート
-from app import app, db, Race, Result, Horse, Jockey
+from app import app
+from models import RESULT_DTYPES, db, Race, Result, Horse, Jockey
+
+# 同時に送るリクエストの最大数（スレッド数）
+MAX_CONCURRENT_REQUESTS = 8
+# 1秒あたりに送るリクエストの最大数（サーバーに負荷をかけすぎないように制限する）
+REQUESTS_PER_SECOND = 4
+# レース結果をデータベースに登録するとき、1回のINSERT・コミットで送る行数
+# 最適な値はデータベースによって違うので、環境変数 INSERT_CHUNK_SIZE で変更できる
+INSERT_CHUNK_SIZE = int(os.environ.get("INSERT_CHUNK_SIZE", 10000))
+# 応答がないサーバーを待ち続けないためのタイムアウト（秒）
+REQUEST_TIMEOUT = 10
+# リクエストに付けるUser-Agent（ブラウザからのアクセスと同じ形式にする）
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+
+# 繰り返し使う正規表現は、あらかじめコンパイルしておく
+# <title>からレース名を取り出す (例: 'ジャパンカップ｜...' の 'ジャパンカップ')
+NAME_RE = re.compile(r"(.+?)｜")
+# <title>から開催日を取り出す (例: 2023年11月26日)
+DATE_RE = re.compile(r"(\d{4}年\d{1,2}月\d{1,2}日)")
+# 馬・騎手ページへのリンクからIDを取り出す
+HORSE_RE = re.compile(r"/horse/(\d+)")
+JOCKEY_RE = re.compile(r"/jockey/result/recent/(\d+)")
+
+# レースIDを作るときに使う、2桁のゼロ埋め文字列の対応表
+# ループの中で zfill を呼ばないように、あらかじめ作っておく (例: ZFILL[3] -> '03')
+ZFILL = [f"{i:02d}" for i in range(13)]
+
+# HTMLのうち、レース結果のテーブル(class="race_table_01")だけを解析するための条件
+# ページ全体(メニューや広告など)の木構造を作らずに済むので、解析が速くなりメモリも減る
+# (実際のテーブルは class="race_table_01 nk_tb_common" のように複数のクラスを持つので、
+#  クラス名の文字列全体ではなく、正規表現で race_table_01 を含むかを調べる)
+RACE_TABLE_STRAINER = SoupStrainer("table", class_=re.compile(r"\brace_table_01\b"))
+# レース名・日付を取り出す<title>は、HTMLを解析せずにバイト列から直接取り出す
+TITLE_RE = re.compile(rb"<title>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+
+# 一度取得したページをSQLiteファイルに保存しておくHTTPセッション
+# 過去のレース結果は変わらないので、再実行時は通信せずに保存済みの内容を使う
+# レースのページはまず1日だけ保存し、結果のテーブルがあったページだけ
+# fetch_race_html で期限なしに保存し直す
+# (まだ結果が出ていない日や、メンテナンス中のページをずっと使い続けないようにするため)
+# 騎手の成績は更新されていくので、騎手ページだけは30日で取り直す
+SESSION = CachedSession(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "netkeiba_cache"),
+    backend="sqlite",
+    expire_after=timedelta(days=30),
+    urls_expire_after={
+        "db.netkeiba.com/race/": timedelta(days=1),
+        "db.netkeiba.com/jockey/": timedelta(days=30),
+    },
+)
+# 同じサーバーへの接続（TCP/TLS）を使い回せるように、スレッド数分の接続プールを用意する
+# 一時的なエラー(混雑など)は、少し待ってから最大3回まで自動で再試行する
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=MAX_CONCURRENT_REQUESTS * 2,
+        max_retries=Retry(
+            total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]
+        ),
+    ),
+)
+SESSION.headers.update({"User-Agent": USER_AGENT})
+
+# 最後にリクエストを送った時刻と、それを複数スレッドから安全に扱うためのロック
+_last_request_time = 0.0
+_request_lock = threading.Lock()
+
+
+def _wait_for_request_slot():
+    """
+    全スレッド合計で REQUESTS_PER_SECOND を超えないように、
+    前回のリクエストから一定間隔が空くまで待機する関数
+    """
+    global _last_request_time
+    with _request_lock:
+        wait = _last_request_time + 1 / REQUESTS_PER_SECOND - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        _last_request_time = time.monotonic()
+
+
+def fetch_page(url: str) -> requests.Response:
+    """
+    キャッシュ付きのセッションでページを取得する関数
+    キャッシュにないページ(または期限切れのページ)だけ、
+    間隔を空けてからサーバーにリクエストを送る
+    """
+    # contains() はキーがあるかしか見ないので、期限切れかどうかも確かめる
+    cache_key = SESSION.cache.create_key(requests.Request("GET", url))
+    cached = SESSION.cache.get_response(cache_key)
+    if cached is None or cached.is_expired:
+        # サーバーに負荷をかけないように、リクエストの間隔を空ける
+        _wait_for_request_slot()
+    return SESSION.get(url, timeout=REQUEST_TIMEOUT)
 
 
 # 競馬場IDと競馬場名の対応表
@@ -25,61 +132,115 @@ PLACE_MAP = {
 }
 
 
-def get_all_race_ids_in_year(year: int) -> list[str]:
+def get_race_day_ids_in_year(year: int) -> list[str]:
     """
-    指定された年のすべてのレースIDを生成ロジックに基づいて取得する関数
+    指定された年の「競馬場・開催回・開催日」の組み合わせ(レースIDの先頭10桁)を
+    すべて作る関数
     """
-    all_race_ids = []
-    print(f"{year}年の全レースIDを探索します...")
+    year_str = str(year)
+
+    # 競馬場ID (01: 札幌, 02: 函館, ..., 10: 東京)、開催回 (通常1〜5回)、
+    # 開催日 (通常1〜12日) のすべての組み合わせを作る
+    return [
+        year_str + ZFILL[place_id] + ZFILL[kaisai_kai] + ZFILL[kaisai_nichi]
+        for place_id, kaisai_kai, kaisai_nichi in itertools.product(
+            range(1, 11), range(1, 7), range(1, 13)
+        )
+    ]
 
-    # 競馬場ID (01: 札幌, 02: 函館, ..., 10: 東京)
-    for place_id in tqdm(range(1, 11), desc="競馬場"):
-        # 開催回 (通常1〜5回)
-        for kaisai_kai in range(1, 7):
-            # 開催日 (通常1〜12日)
-            for kaisai_nichi in range(1, 13):
-                # レース番号 (1〜12レース)
-                for race_num in range(1, 13):
-                    race_id = (
-                        f"{year}"
-                        f"{str(place_id).zfill(2)}"
-                        f"{str(kaisai_kai).zfill(2)}"
-                        f"{str(kaisai_nichi).zfill(2)}"
-                        f"{str(race_num).zfill(2)}"
-                    )
-                    all_race_ids.append(race_id)
 
-    print(f"合計 {len(all_race_ids)} 件のレースIDを生成しました。")
-    return all_race_ids
+def get_all_race_ids_in_year(year: int) -> Iterator[str]:
+    """
+    指定された年のレースIDを、実際にレースが開催された日の分だけ順番に返す
+    ジェネレーター関数
+    """
+    print(f"{year}年の全レースIDを探索します...")
+    day_ids = get_race_day_ids_in_year(year)
+
+    # 組み合わせのほとんどは開催されていない日なので、
+    # まず各日の1レース目だけを取得し、結果がない日は残りの11レースを取得しない
+    # (取得したページはキャッシュされるので、1レース目を本番で取り直すときは通信しない)
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        held = tqdm(
+            executor.map(race_day_exists, day_ids),
+            total=len(day_ids),
+            desc="開催日を確認中",
+        )
+        for day_id, exists in zip(day_ids, held):
+            if not exists:
+                continue
+            # レース番号 (1〜12レース)
+            for race_num in range(1, 13):
+                yield day_id + ZFILL[race_num]
 
 
-def scrape_race_result(race_id: str) -> tuple[dict | None, pd.DataFrame]:
+def fetch_race_html(race_id: str) -> bytes | None:
     """
-    指定されたレースIDの結果ページをスクレイピングし、
-    (レース情報, 整形済みDataFrame)を返す関数
+    指定されたレースIDの結果ページのHTMLを、バイト列のままダウンロードする関数
+    (netkeibaのページはEUC-JPなので、文字コードは解析時に指定する)
+    取得に失敗した場合はNoneを返す
     """
     url = f"https://db.netkeiba.com/race/{race_id}/"
     try:
-        response = requests.get(url)
-        response.encoding = response.apparent_encoding
-        soup = BeautifulSoup(response.text, "html.parser")
+        response = fetch_page(url)
+    except requests.exceptions.RequestException as e:
+        print(f"エラー: レースID {race_id} のページ取得中にエラーが発生しました: {e}")
+        return None
+    # 結果のテーブルがあるページは変わらないので、期限なし(expires=None)で保存し直す
+    if not response.from_cache and b"race_table_01" in response.content:
+        SESSION.cache.save_response(response, expires=None)
+    return response.content
+
 
+def race_day_exists(day_id: str) -> bool:
+    """
+    レースIDの先頭10桁(競馬場・開催回・開催日)を受け取り、
+    その日の1レース目の結果ページがあるか(=開催された日か)を確認する関数
+    """
+    html = fetch_race_html(day_id + "01")
+    # 結果のテーブルがあるかは、HTMLを解析せずにバイト列の検索で確認する
+    return html is not None and b"race_table_01" in html
+
+
+def scrape_race_result(race_id: str) -> tuple[dict | None, list[dict]]:
+    """
+    指定されたレースIDの結果ページをスクレイピングし、
+    (レース情報, 1頭分ずつの結果の辞書のリスト)を返す関数
+    """
+    html = fetch_race_html(race_id)
+    return parse_race_result(race_id, html)
+
+
+def parse_race_result(
+    race_id: str, html: bytes | None
+) -> tuple[dict | None, list[dict]]:
+    """
+    レース結果ページのHTMLを解析し、(レース情報, 1頭分ずつの結果の辞書のリスト)を
+    返す関数
+    DataFrameへの変換と整形は、全レース分をまとめてから main() で1回だけ行う
+    ※ main() では別プロセスで実行されるため、モジュールの直下に定義しておく必要がある
+    """
+    if html is None:
+        return None, []
+
+    try:
         # --- レース情報の抽出 ---
         race_info = {"id": race_id}
 
         # <title>タグからレース名などを抽出
-        title_tag = soup.find("title")
-        if not title_tag:
-            return None, pd.DataFrame()  # titleタグがなければ存在しないページ
-        title_text = title_tag.text
+        # netkeibaのページは常にEUC-JPなので、<title>の中身だけを文字列に変換する
+        title_match = TITLE_RE.search(html)
+        if not title_match:
+            return None, []  # titleタグがなければ存在しないページ
+        title_text = unescape(title_match.group(1).decode("euc-jp", errors="replace"))
 
         # 正規表現でレース名を抽出 (例: 'ジャパンカップ' の部分)
-        name_match = re.search(r"(.+?)｜", title_text)
+        name_match = NAME_RE.search(title_text)
         if name_match:
             race_info["name"] = name_match.group(1).strip()
 
         # 日付の抽出 (例: 2023年11月26日)
-        date_match = re.search(r"(\d{4}年\d{1,2}月\d{1,2}日)", title_text)
+        date_match = DATE_RE.search(title_text)
         if date_match:
             dt = datetime.strptime(date_match.group(1), "%Y年%m月%d日")
             race_info["date"] = dt.date()
@@ -88,78 +249,110 @@ def scrape_race_result(race_id: str) -> tuple[dict | None, pd.DataFrame]:
         place_id = race_id[4:6]
         race_info["venue"] = PLACE_MAP.get(place_id, "不明")
 
+        # レース名か日付がない場合は、存在しないレースと見なす
+        # (この時点で分かるので、結果のテーブルは解析しない)
+        if "name" not in race_info or "date" not in race_info:
+            return None, []
+
         # --- レース結果テーブルの抽出 ---
-        # 騎手IDと馬IDを抽出するために、HTMLを直接解析する方法に変更
+        # C言語で実装された高速なlxmlパーサーで、結果のテーブルだけを解析する
+        # netkeibaのページは常にEUC-JPなので、文字コードを指定して判定処理を省く
+        soup = BeautifulSoup(
+            html, "lxml", from_encoding="euc-jp", parse_only=RACE_TABLE_STRAINER
+        )
         race_table = soup.find("table", class_="race_table_01")
         if not race_table:
-            return None, pd.DataFrame()
+            return None, []
 
-        rows = []
-        for tr in race_table.find_all("tr")[1:]:  # ヘッダー行をスキップ
-            row = {}
-            tds = tr.find_all("td")
-            if len(tds) < 13:
-                continue
+        rows = parse_result_rows(race_table)
+        if not rows:
+            return None, []
 
-            row["着 順"] = tds[0].text.strip()
-            row["枠 番"] = tds[1].text.strip()
-            row["馬 番"] = tds[2].text.strip()
-            row["馬名"] = tds[3].text.strip()
-            # 馬IDの抽出
-            horse_link = tds[3].find("a")
-            if horse_link:
-                match = re.search(r"/horse/(\d+)", horse_link["href"])
-                row["horse_id"] = match.group(1) if match else None
-            else:
-                row["horse_id"] = None
-            row["性齢"] = tds[4].text.strip()
-            row["斤量"] = tds[5].text.strip()
-            row["騎手"] = tds[6].text.strip()
-            # 騎手IDの抽出
-            jockey_link = tds[6].find("a")
-            if jockey_link:
-                match = re.search(r"/jockey/result/recent/(\d+)", jockey_link["href"])
-                row["jockey_id"] = match.group(1) if match else None
-            else:
-                row["jockey_id"] = None
-            row["タイム"] = tds[7].text.strip()
-            row["着差"] = tds[8].text.strip()
-            row["単勝"] = tds[12].text.strip()
-            row["人 気"] = tds[13].text.strip()
-            row["馬体重"] = tds[14].text.strip()
-            rows.append(row)
-
-        df = pd.DataFrame(rows)
-        # IDが取得できなかった行はこの時点で削除
-        df = df.dropna(subset=["horse_id", "jockey_id"])
-        if df.empty:
-            return None, pd.DataFrame()
-
-        cleaned_df = clean_data(df)
-
-        # 必要な情報が全て揃っているか確認
-        if "name" in race_info and "date" in race_info and "venue" in race_info:
-            return race_info, cleaned_df
-        else:
-            # 情報が不十分な場合は、存在しないレースと見なす
-            return None, pd.DataFrame()
+        # どのレースの結果かが分かるように、各行にレースIDを入れておく
+        for row in rows:
+            row["race_id"] = race_id
+
+        return race_info, rows
 
     except IndexError:
         # テーブルが見つからない場合は、存在しないレースと見なす
-        return None, pd.DataFrame()
+        return None, []
     except Exception as e:
         print(f"エラー: レースID {race_id} の処理中に予期せぬエラーが発生しました: {e}")
-        return None, pd.DataFrame()
+        return None, []
+
+
+def _to_int(text: str, default: int | None = None) -> int | None:
+    """
+    文字列を整数に変換する関数。変換できない場合は default を返す
+    """
+    try:
+        return int(text)
+    except ValueError:
+        return default
+
+
+def _to_float(text: str, default: float | None = None) -> float | None:
+    """
+    文字列を小数に変換する関数。変換できない場合は default を返す
+    """
+    try:
+        return float(text)
+    except ValueError:
+        return default
+
+
+def parse_result_rows(race_table) -> list[dict]:
+    """
+    レース結果テーブル(class="race_table_01")の各行を解析し、
+    1頭分のデータを1つの辞書にしたリストを返す関数
+    数値の列は、この時点で int / float に変換しておく
+    """
+    rows = []
+    for tr in race_table.find_all("tr")[1:]:  # ヘッダー行をスキップ
+        row = {}
+        tds = tr.find_all("td")
+        if len(tds) < 13:
+            continue
+
+        # 着順が数値でない行は結果として使えないのでスキップ (例: '除外', '中止' など)
+        rank = _to_int(tds[0].text.strip())
+        if rank is None:
+            continue
+
+        # 馬IDと騎手IDの抽出
+        # IDが取得できなかった行はデータベースに保存できないので、ここでスキップ
+        horse_link = tds[3].find("a")
+        horse_match = HORSE_RE.search(horse_link["href"]) if horse_link else None
+        jockey_link = tds[6].find("a")
+        jockey_match = JOCKEY_RE.search(jockey_link["href"]) if jockey_link else None
+        if horse_match is None or jockey_match is None:
+            continue
+
+        row["着 順"] = rank
+        row["枠 番"] = int(tds[1].text.strip())
+        row["馬 番"] = int(tds[2].text.strip())
+        row["馬名"] = tds[3].text.strip()
+        row["horse_id"] = horse_match.group(1)
+        row["性齢"] = tds[4].text.strip()
+        row["斤量"] = float(tds[5].text.strip())
+        row["騎手"] = tds[6].text.strip()
+        row["jockey_id"] = jockey_match.group(1)
+        # 単勝・人気・馬体重は、値がない場合 (例: '---', '計不') は0にする
+        row["単勝"] = _to_float(tds[12].text.strip(), 0.0)
+        row["人 気"] = _to_int(tds[13].text.strip(), 0)
+        # 馬体重は体重のみを取り出す 例: '498(+4)' -> 498
+        row["馬体重"] = _to_int(tds[14].text.strip().split("(", 1)[0], 0)
+        rows.append(row)
+    return rows
 
 
 def clean_data(df: pd.DataFrame) -> pd.DataFrame:
     """
     スクレイピングで取得したDataFrameを整形する関数
     """
-    # 必要のない列を削除
-    df = df.drop(["着差", "タイム"], axis=1, errors="ignore")
-
     # 列名をリネーム
+    # (使わない列 'タイム'・'着差' は parse_result_rows で取り出していない)
     df = df.rename(
         columns={
             "着 順": "rank",
@@ -175,27 +368,10 @@ def clean_data(df: pd.DataFrame) -> pd.DataFrame:
         }
     )
 
-    # 'rank' 列が数値でない行を削除 (例: '除外', '中止' など)
-    df = df[pd.to_numeric(df["rank"], errors="coerce").notna()]
-    if df.empty:
-        return df
-
-    # データ型を変換
-    df["rank"] = df["rank"].astype(int)
-    df["waku"] = df["waku"].astype(int)
-    df["umaban"] = df["umaban"].astype(int)
-    df["jockey_weight"] = df["jockey_weight"].astype(float)
-    df["single_price"] = pd.to_numeric(df["single_price"], errors="coerce").fillna(0.0)
-    df["popular"] = pd.to_numeric(df["popular"], errors="coerce").fillna(0).astype(int)
-
-    # 'horse_weight' から体重のみを抽出し、数値に変換
-    # 例: '498(+4)' -> 498, '計不' -> 0
-    df["horse_weight"] = df["horse_weight"].str.split("(", expand=True)[0]
-    df["horse_weight"] = (
-        pd.to_numeric(df["horse_weight"], errors="coerce").fillna(0).astype(int)
-    )
-
-    return df
+    # 数値の列は parse_result_rows で変換済みなので、
+    # ここではメモリを減らすために、整数の列を小さい型にまとめて変換するだけ
+    # (単勝・斤量はデータベースに保存するので、誤差が出ないよう float64 のままにする)
+    return df.astype(RESULT_DTYPES)
 
 
 def scrape_jockey_performance(jockey_id: str) -> dict:
@@ -204,47 +380,29 @@ def scrape_jockey_performance(jockey_id: str) -> dict:
     """
     url = f"https://db.netkeiba.com/jockey/{jockey_id}/"
     try:
-        response = requests.get(url)
-        # 文字化け対策
-        response.encoding = "EUC-JP"
-        soup = BeautifulSoup(response.text, "html.parser")
-
-        # 生涯成績テーブルを取得 (クラス名が変更されている)
-        results_table = soup.find("table", class_="ResultsByYears")
-        if not results_table:
-            return {}
-
-        # '累計' の行を探す (より堅牢な方法に変更)
-        target_tr = None
-        for tr in results_table.find_all("tr"):
-            if "累計" in tr.text:
-                target_tr = tr
-                break
-
-        if not target_tr:
+        response = fetch_page(url)
+        # 騎手ページは表を1つ読むだけなので、C言語で実装された軽量なselectolaxで解析する
+        # 文字化け対策として、文字コード(EUC-JP)を指定して文字列に変換してから渡す
+        tree = LexborHTMLParser(response.content.decode("euc-jp", errors="replace"))
+
+        # 生涯成績テーブルから '累計' の行を探す
+        target_tr = next(
+            (tr for tr in tree.css("table.ResultsByYears tr") if "累計" in tr.text()),
+            None,
+        )
+        if target_tr is None:
             return {}
 
-        # 勝率、連対率、複勝率を抽出 (tdタグのインデックスが変更されている)
-        tds = target_tr.find_all("td")
+        # 勝率、連対率、複勝率を抽出
+        tds = target_tr.css("td")
         if len(tds) > 11:
             # パーセント記号を除去してfloatに変換
-            win_rate_str = tds[9].text.strip().replace("％", "").replace("%", "")
-            place_rate_str = tds[10].text.strip().replace("％", "").replace("%", "")
-            show_rate_str = tds[11].text.strip().replace("％", "").replace("%", "")
-
-            # データが存在しない場合（'--'など）を考慮
-            win_rate = float(win_rate_str) if win_rate_str not in ["--", ""] else 0.0
-            place_rate = (
-                float(place_rate_str) if place_rate_str not in ["--", ""] else 0.0
-            )
-            show_rate = float(show_rate_str) if show_rate_str not in ["--", ""] else 0.0
-
-            result = {
-                "win_rate": win_rate,
-                "place_rate": place_rate,
-                "show_rate": show_rate,
+            # データが存在しない場合（'--'など）は0にする
+            return {
+                "win_rate": _to_float(tds[9].text().strip().rstrip("％%"), 0.0),
+                "place_rate": _to_float(tds[10].text().strip().rstrip("％%"), 0.0),
+                "show_rate": _to_float(tds[11].text().strip().rstrip("％%"), 0.0),
             }
-            return result
         return {}
 
     except Exception as e:
@@ -259,69 +417,95 @@ def save_results_to_db(races_data: list[dict], results_df: pd.DataFrame):
     # Flaskのアプリケーションコンテキスト内で実行
     with app.app_context():
         # --- 1. レース情報を保存 ---
-        saved_races = 0
-        for race_info in races_data:
-            # 既に同じIDのレースが存在しないか確認
-            exists = db.session.get(Race, race_info["id"])
-            if not exists:
-                race = Race(**race_info)
-                db.session.add(race)
-                saved_races += 1
+        # DBに保存済みのレースIDを1回のSQLでまとめて取得し、新しいレースだけを登録する
+        existing_race_ids = set(
+            db.session.scalars(
+                select(Race.id).where(
+                    Race.id.in_([race_info["id"] for race_info in races_data])
+                )
+            )
+        )
+        new_races = [
+            race_info
+            for race_info in races_data
+            if race_info["id"] not in existing_race_ids
+        ]
 
-        if saved_races > 0:
-            print(f"{saved_races}件の新しいレース情報を追加しました。")
+        if new_races:
+            # 1件ずつaddせず、INSERT文1つでまとめて登録する
+            db.session.execute(insert(Race), new_races)
+            print(f"{len(new_races)}件の新しいレース情報を追加しました。")
 
         # --- 2. 馬と騎手の情報を先にまとめて登録 ---
-        # 効率化のため、先にDBに存在する馬・騎手をすべて取得
-        existing_horses = {h.id: h for h in Horse.query.all()}
-        existing_jockeys = {j.id: j for j in Jockey.query.all()}
-        existing_horse_names = {h.name for h in existing_horses.values()}
-
-        # スクレイピング結果からユニークな馬・騎手情報を取得 (IDと名前のタプル)
-        unique_horses_scraped = set(
-            zip(results_df["horse_id"], results_df["horse_name"])
-        )
-        unique_jockeys_scraped = set(
-            zip(results_df["jockey_id"], results_df["jockey_name"])
+        # スクレイピング結果の馬ID・騎手IDを1回だけ数値に変換し、
+        # IDから名前を引ける辞書を作る (同じIDは1つにまとまる)
+        horse_ids = results_df["horse_id"].astype("int64").tolist()
+        jockey_ids = results_df["jockey_id"].astype("int64").tolist()
+        horse_names = dict(zip(horse_ids, results_df["horse_name"].tolist()))
+        jockey_names = dict(zip(jockey_ids, results_df["jockey_name"].tolist()))
+        # 騎手ページのURLには、ゼロ埋めされた元の文字列のIDを使う
+        jockey_page_ids = dict(zip(jockey_ids, results_df["jockey_id"].tolist()))
+
+        # 今回の馬をまとめてINSERTし、登録済みの馬(IDか名前が同じ)はDB側でスキップさせる
+        # (ON CONFLICT DO NOTHING を使うと、登録済みかをPython側で調べる必要がない)
+        print(f"馬 {len(horse_names)}頭を登録します (登録済みの馬はスキップされます)。")
+        db.session.execute(
+            pg_insert(Horse).on_conflict_do_nothing(),
+            [
+                {"id": horse_id, "name": horse_name}
+                for horse_id, horse_name in horse_names.items()
+            ],
         )
 
-        # DBに存在しない新しい馬・騎手だけを抽出
-        new_horses_to_add = {
-            (id, name)
-            for id, name in unique_horses_scraped
-            if int(id) not in existing_horses and name not in existing_horse_names
-        }
-        new_jockeys_to_add = {
-            (id, name)
-            for id, name in unique_jockeys_scraped
-            if int(id) not in existing_jockeys
-        }
-
-        jockey_performance_cache = {}  # 騎手成績の一時キャッシュ
+        # 騎手は成績ページを取得する必要があるので、DBに既に存在する騎手を先に調べる
+        # (今回のデータに登場する騎手だけを問い合わせ、テーブル全体は読み込まない)
+        existing_jockeys = set(
+            db.session.scalars(
+                select(Jockey.id).where(Jockey.id.in_(list(jockey_names)))
+            )
+        )
 
-        if new_horses_to_add:
-            print(f"新しい馬 {len(new_horses_to_add)}頭を登録します。")
-            for horse_id, horse_name in new_horses_to_add:
-                db.session.add(Horse(id=int(horse_id), name=horse_name))
+        # DBに存在しない新しい騎手のIDだけを抽出
+        # (pd.Index.difference は並べ替えた配列同士をC言語の速度で比較する)
+        new_jockey_ids = (
+            pd.Index(list(jockey_names), dtype="int64")
+            .difference(pd.Index(list(existing_jockeys), dtype="int64"))
+            .tolist()
+        )
 
-        if new_jockeys_to_add:
-            print(f"新しい騎手 {len(new_jockeys_to_add)}名の情報を取得・登録します。")
-            for jockey_id, jockey_name in tqdm(
-                new_jockeys_to_add, desc="騎手情報取得中"
-            ):
-                # 成績をスクレイピング
-                performance = scrape_jockey_performance(jockey_id)
-                jockey_performance_cache[jockey_id] = performance  # キャッシュに保存
-                db.session.add(
-                    Jockey(
-                        id=int(jockey_id),
-                        name=jockey_name,
-                        win_rate=performance.get("win_rate"),
-                        place_rate=performance.get("place_rate"),
-                        show_rate=performance.get("show_rate"),
+        if new_jockey_ids:
+            print(f"新しい騎手 {len(new_jockey_ids)}名の情報を取得・登録します。")
+            # 成績ページの取得は通信待ちがほとんどなので、複数スレッドで同時に取得する
+            # (リクエストの間隔は fetch_page の中で全スレッド共通に制限される)
+            with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+                performances = list(
+                    tqdm(
+                        executor.map(
+                            scrape_jockey_performance,
+                            [
+                                jockey_page_ids[jockey_id]
+                                for jockey_id in new_jockey_ids
+                            ],
+                        ),
+                        total=len(new_jockey_ids),
+                        desc="騎手情報取得中",
                     )
                 )
-                time.sleep(1)  # サーバー負荷軽減
+            new_jockey_rows = [
+                {
+                    "id": jockey_id,
+                    "name": jockey_names[jockey_id],
+                    "win_rate": performance.get("win_rate"),
+                    "place_rate": performance.get("place_rate"),
+                    "show_rate": performance.get("show_rate"),
+                }
+                for jockey_id, performance in zip(new_jockey_ids, performances)
+            ]
+            # 取得した騎手をINSERT文1つでまとめて登録する
+            # (同じ名前の騎手が登録済みの場合などは、DB側でスキップさせる)
+            db.session.execute(
+                pg_insert(Jockey).on_conflict_do_nothing(), new_jockey_rows
+            )
 
         # --- 3. レース結果を保存 ---
         # 一度コミットして、新しい馬・騎手のIDを確定させる
@@ -332,48 +516,80 @@ def save_results_to_db(races_data: list[dict], results_df: pd.DataFrame):
             print(f"レース・馬・騎手の保存中にエラーが発生: {e}")
             return
 
-        # IDを効率的に引けるように、馬ID/騎手IDをキーにした辞書を作成
-        horse_map = {h.id for h in Horse.query.all()}
-        jockey_map = {j.id for j in Jockey.query.all()}
+        # 外部キーのチェック用に、今回の馬ID/騎手IDのうちDBに存在するものの集合を作成
+        # (IDは違うが名前が同じ、などでスキップされた馬・騎手は含まれない)
+        horse_map = set(
+            db.session.scalars(select(Horse.id).where(Horse.id.in_(list(horse_names))))
+        )
+        jockey_map = set(
+            db.session.scalars(
+                select(Jockey.id).where(Jockey.id.in_(list(jockey_names)))
+            )
+        )
 
-        saved_results = 0
-        for _, row in tqdm(
-            results_df.iterrows(), total=len(results_df), desc="レース結果をDBに保存中"
+        # 今回のレースについて、DBに保存済みの (レースID, 馬番) の組を1回のSQLで取得
+        # (1行ずつ「既に存在するか」を問い合わせると、行数と同じ回数SQLが発行されるため)
+        race_ids = results_df["race_id"].unique().tolist()
+        existing_results = {
+            (race_id, umaban)
+            for race_id, umaban in db.session.execute(
+                select(Result.race_id, Result.umaban).where(
+                    Result.race_id.in_(race_ids)
+                )
+            )
+        }
+
+        # iterrows()は1行ごとにSeriesを作るので遅い
+        # 代わりに必要な列をPythonのリストとして取り出し、zipで1行ずつ並べて処理する
+        columns = [
+            "race_id",
+            "rank",
+            "waku",
+            "umaban",
+            "horse_id",
+            "sex_age",
+            "jockey_weight",
+            "jockey_id",
+            "single_price",
+            "popular",
+            "horse_weight",
+        ]
+        new_results = []
+        for values in tqdm(
+            zip(*(results_df[column].tolist() for column in columns)),
+            total=len(results_df),
+            desc="レース結果をDBに保存中",
         ):
+            result = dict(zip(columns, values))
+            # 馬IDと騎手IDは文字列でスクレイピングしているので数値に変換
+            result["horse_id"] = int(result["horse_id"])
+            result["jockey_id"] = int(result["jockey_id"])
+
             # 外部キー制約を満たすかチェック
             if (
-                int(row["horse_id"]) not in horse_map
-                or int(row["jockey_id"]) not in jockey_map
+                result["horse_id"] not in horse_map
+                or result["jockey_id"] not in jockey_map
             ):
                 continue
 
             # 既に同じレースの同じ馬番の結果が存在しないか確認
-            exists = Result.query.filter_by(
-                race_id=row["race_id"], umaban=row["umaban"]
-            ).one_or_none()
-            if not exists:
-                result = Result(
-                    race_id=row["race_id"],
-                    rank=row["rank"],
-                    waku=row["waku"],
-                    umaban=row["umaban"],
-                    horse_id=int(row["horse_id"]),
-                    sex_age=row["sex_age"],
-                    jockey_weight=row["jockey_weight"],
-                    jockey_id=int(row["jockey_id"]),
-                    single_price=row["single_price"],
-                    popular=row["popular"],
-                    horse_weight=row["horse_weight"],
-                )
-                db.session.add(result)
-                saved_results += 1
+            key = (result["race_id"], result["umaban"])
+            if key in existing_results:
+                continue
+            existing_results.add(key)
 
-        if saved_results > 0:
-            print(f"{saved_results}件の新しいレース結果を追加しました。")
+            new_results.append(result)
 
-        # 最終的な変更をコミット
+        # 新しいレース結果を INSERT_CHUNK_SIZE 行ずつ登録し、その都度コミットする
+        # (1年分を1つのトランザクションにすると、DBの変更履歴が大きくなりすぎるため)
         try:
-            db.session.commit()
+            for start in range(0, len(new_results), INSERT_CHUNK_SIZE):
+                db.session.execute(
+                    insert(Result), new_results[start : start + INSERT_CHUNK_SIZE]
+                )
+                db.session.commit()
+            if new_results:
+                print(f"{len(new_results)}件の新しいレース結果を追加しました。")
             print("データベースへの保存が完了しました。")
         except Exception as e:
             db.session.rollback()
@@ -384,47 +600,68 @@ def main():
     """
     スクレイピングとDB保存を実行するメイン関数
     """
-    # 2023年の全レースIDを取得
-    race_ids = get_all_race_ids_in_year(2023)
+    try:
+        # 2023年のレースIDを取得 (開催された日のレースだけ)
+        race_ids = list(get_all_race_ids_in_year(2023))
+
+        # 動作確認のため、最初の5件に絞る
+        # race_ids = race_ids[:5]
+
+        # 全レースの結果を1頭分ずつの辞書として集め、最後に1回でDataFrameにする
+        # (レースごとに小さなDataFrameを作って pd.concat すると、結合の手間が大きいため)
+        all_rows = []
+        race_info_list = []
+
+        print(f"合計 {len(race_ids)} 件のレース結果をスクレイピングします...")
+        # 1. 複数のスレッドで同時にダウンロードし、通信の待ち時間を重ねて短縮する
+        #    (サーバーへの負荷は _wait_for_request_slot で全体の速度を制限して抑える)
+        # 2. ダウンロードできたページから順に、別プロセスでHTMLを解析する
+        #    (解析はCPUを使う処理なので、プロセスを分けると複数のCPUコアで並列に動く)
+        with (
+            ProcessPoolExecutor() as parse_pool,
+            ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as fetch_pool,
+        ):
+            # Linuxでは解析用のプロセスは fork で作られ、最初の仕事を渡したときに
+            # まとめて起動する。ダウンロード用のスレッドが通信中(ロックを持ったまま)に
+            # forkすると子プロセスが止まることがあるので、スレッドを動かす前に
+            # 空の仕事を1つ渡して、先にすべてのプロセスを起動しておく
+            parse_pool.submit(parse_race_result, "", None).result()
+
+            # executor.mapは、結果をrace_idsと同じ順番で返す
+            # tqdmを使って、ダウンロードの進み具合をプログレスバーで表示
+            htmls = tqdm(
+                fetch_pool.map(fetch_race_html, race_ids),
+                total=len(race_ids),
+                desc="ダウンロード中",
+            )
+            scraped = parse_pool.map(parse_race_result, race_ids, htmls, chunksize=16)
+            for race_id, (race_info, rows) in zip(race_ids, scraped):
+                # スクレイピングの実行とDBへの保存
+                if race_info and rows:
+                    print(
+                        f"\n取得成功: {race_info['name']}, {race_info['date']}, "
+                        f"{race_info['venue']}, ({race_id})"
+                    )
+                    all_rows.extend(rows)
+                    race_info_list.append(race_info)
 
-    # 動作確認のため、最初の5件に絞る
-    # race_ids = race_ids[:5]
+        if all_rows:
+            # 全てのレース結果の辞書のリストから、1回でDataFrameを作って整形する
+            all_results_df = clean_data(pd.DataFrame.from_records(all_rows))
+            print("\nスクレイピングが完了しました。")
+            print("取得したデータの一部:")
+            print(all_results_df.head())
+            print(f"\n全体の件数: {len(all_results_df)}")
 
-    all_results = []
-    race_info_list = []
+            # データベースに保存
+            save_results_to_db(race_info_list, all_results_df)
 
-    print(f"合計 {len(race_ids)} 件のレース結果をスクレイピングします...")
-    # tqdmを使ってプログレスバーを表示
-    for race_id in tqdm(race_ids):
-        race_info, result_df = scrape_race_result(race_id)
+        else:
+            print("有効なデータは一件も取得できませんでした。")
 
-        # スクレイピングの実行とDBへの保存
-        if race_info and not result_df.empty:
-            print(
-                f"\n取得成功: {race_info['name']}, {race_info['date']}, "
-                f"{race_info['venue']}, ({race_id})"
-            )
-            result_df["race_id"] = race_id
-            all_results.append(result_df)
-            race_info_list.append(race_info)
-
-        # サーバーに負荷をかけないための待機
-        time.sleep(1)
-
-    # 全てのレース結果を一つのDataFrameに結合
-    if all_results:
-        # DataFrameのリストを一つのDataFrameに結合
-        all_results_df = pd.concat(all_results, ignore_index=True)
-        print("\nスクレイピングが完了しました。")
-        print("取得したデータの一部:")
-        print(all_results_df.head())
-        print(f"\n全体の件数: {len(all_results_df)}")
-
-        # データベースに保存
-        save_results_to_db(race_info_list, all_results_df)
-
-    else:
-        print("有効なデータは一件も取得できませんでした。")
+    finally:
+        # プールしていた接続とキャッシュのファイルを閉じる
+        SESSION.close()
 
 
 # このファイルが直接実行された場合に、main()関数を呼び出す
@@ -0,0 +1,179 @@
+import pytest
+
+# 出馬表スクレイパーの依存ライブラリがない環境ではテストをスキップする
+bs4 = pytest.importorskip("bs4")
+race_card_scraper = pytest.importorskip("race_card_scraper")
+
+
+def make_horse_row(waku, umaban, sex_age, jockey_weight, jockey_href, horse_weight):
+    """
+    出馬表の1頭分の行(14列)のHTMLを作る関数
+    """
+    cells = [
+        waku,
+        umaban,
+        "",
+        "テストホース",
+        sex_age,
+        jockey_weight,
+        f'<a href="{jockey_href}">騎手</a>' if jockey_href else "騎手",
+        "調教師",
+        horse_weight,
+        "",
+        "",
+        "",
+        "",
+        "",
+    ]
+    return '<tr class="HorseList">' + "".join(f"<td>{c}</td>" for c in cells) + "</tr>"
+
+
+# netkeibaの出馬表ページを最小限にまねたHTML
+# 実際のページと同じく、出馬表のテーブルは複数のクラスを持つ
+# 3頭目は馬体重の発表前、4頭目は列が足りない行
+RACE_CARD_HTML = f"""
+<html>
+<body>
+<table class="Shutuba_Table RaceTable01 ShutubaTable">
+{make_horse_row("1", "1", "牡4", "58.0", "/jockey/result/recent/01163/", "496(+2)")}
+{make_horse_row("2", "3", "牝3", "54.0", None, "470(-4)")}
+{make_horse_row("3", "5", "セ5", "57.5", "/jockey/result/recent/05339/", "計不")}
+<tr class="HorseList"><td>4</td></tr>
+</table>
+</body>
+</html>
+""".encode("euc-jp")
+
+
+class FakeResponse:
+    content = RACE_CARD_HTML
+
+
+class FakeSession:
+    """
+    騎手の成績の問い合わせに、決まった行を返すデータベースセッションの代わり
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, query):
+        return self
+
+    def all(self):
+        return self.rows
+
+
+def test_race_card_strainer_keeps_multi_class_table():
+    soup = bs4.BeautifulSoup(
+        RACE_CARD_HTML,
+        "lxml",
+        from_encoding="euc-jp",
+        parse_only=race_card_scraper._RACE_CARD_STRAINER,
+    )
+
+    table = soup.find("table", class_="RaceTable01")
+    assert table is not None
+    assert len(table.find_all("tr", class_="HorseList")) == 4
+
+
+def test_scrape_race_card_parses_rows(monkeypatch):
+    monkeypatch.setattr(race_card_scraper, "_wait_for_request_slot", lambda: None)
+    monkeypatch.setattr(
+        race_card_scraper._session, "get", lambda url, timeout: FakeResponse()
+    )
+
+    horses = race_card_scraper.scrape_race_card("https://example.com/shutuba")
+
+    # 列が足りない行だけが除かれ、馬体重の発表前の馬は None のまま残る
+    assert horses == [
+        {
+            "waku": 1,
+            "umaban": 1,
+            "sex": 0,
+            "age": 4,
+            "jockey_weight": 58.0,
+            "jockey_id": 1163,
+            "horse_weight": 496,
+        },
+        {
+            "waku": 2,
+            "umaban": 3,
+            "sex": 1,
+            "age": 3,
+            "jockey_weight": 54.0,
+            "jockey_id": None,
+            "horse_weight": 470,
+        },
+        {
+            "waku": 3,
+            "umaban": 5,
+            "sex": 2,
+            "age": 5,
+            "jockey_weight": 57.5,
+            "jockey_id": 5339,
+            "horse_weight": None,
+        },
+    ]
+
+
+def test_preprocess_for_prediction_builds_structured_array():
+    horses = [
+        {
+            "waku": 1,
+            "umaban": 1,
+            "sex": 0,
+            "age": 4,
+            "jockey_weight": 58.0,
+            "jockey_id": 1163,
+            "horse_weight": 496,
+        },
+        {
+            "waku": 2,
+            "umaban": 3,
+            "sex": 1,
+            "age": 3,
+            "jockey_weight": 54.0,
+            "jockey_id": None,
+            "horse_weight": 470,
+        },
+        {
+            "waku": 3,
+            "umaban": 5,
+            "sex": 2,
+            "age": 5,
+            "jockey_weight": 57.5,
+            "jockey_id": 5339,
+            "horse_weight": None,
+        },
+    ]
+    # 成績がNULLの項目は0として扱われる
+    session = FakeSession([(1163, 0.25, None, 0.5)])
+
+    features = race_card_scraper.preprocess_for_prediction(horses, session)
+
+    # 馬体重がない馬は除かれ、騎手IDがない馬は成績を0として残る
+    assert features.dtype == race_card_scraper.PREDICTION_DTYPE
+    assert features.tolist() == [
+        (1, 1, 58.0, 496, 0, 4, 0.25, 0.0, 0.5),
+        (2, 3, 54.0, 470, 1, 3, 0.0, 0.0, 0.0),
+    ]
+
+
+def test_preprocess_for_prediction_without_usable_horses():
+    horses = [
+        {
+            "waku": 1,
+            "umaban": 1,
+            "sex": 0,
+            "age": 4,
+            "jockey_weight": 58.0,
+            "jockey_id": 1163,
+            "horse_weight": None,
+        }
+    ]
+
+    features = race_card_scraper.preprocess_for_prediction(horses, FakeSession([]))
+
+    assert len(features) == 0
+    assert features.dtype == race_card_scraper.PREDICTION_DTYPE
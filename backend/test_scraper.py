@@ -0,0 +1,38 @@
+import pytest
+
+# スクレイパーの依存ライブラリ(bs4, Flaskなど)がない環境ではテストをスキップする
+pytest.importorskip("bs4")
+scraper = pytest.importorskip("scraper")
+
+# netkeibaのレース結果ページを最小限にまねたHTML
+# 実際のページと同じく、結果のテーブルは複数のクラスを持つ
+RACE_PAGE_HTML = """
+<html>
+<head><title>ジャパンカップ｜2023年11月26日 | 競馬データベース</title></head>
+<body>
+<table class="race_table_01 nk_tb_common">
+<tr><th>着順</th></tr>
+<tr>
+<td>1</td><td>1</td><td>2</td>
+<td><a href="/horse/2019105219/">イクイノックス</a></td>
+<td>牡4</td><td>58</td>
+<td><a href="/jockey/result/recent/01163/">ルメール</a></td>
+<td>2:21.8</td><td></td><td></td><td></td><td></td>
+<td>1.3</td><td>1</td><td>496(+2)</td>
+</tr>
+</table>
+</body>
+</html>
+""".encode("euc-jp")
+
+
+def test_parse_race_result_with_multi_class_table():
+    race_info, rows = scraper.parse_race_result("202305050812", RACE_PAGE_HTML)
+
+    assert race_info is not None
+    assert race_info["name"] == "ジャパンカップ"
+    assert len(rows) == 1
+    assert rows[0]["horse_id"] == "2019105219"
+    assert rows[0]["jockey_id"] == "01163"
+    assert rows[0]["馬体重"] == 496
+    assert rows[0]["race_id"] == "202305050812"
@@ -1,44 +1,60 @@
+import hashlib
+import os
 import pandas as pd
-from app import app, db, model_features
+from sqlalchemy import func, select
+from app import app, db
+from models import RESULT_DTYPES, Jockey, Result
+from race_card_scraper import MODEL_FEATURES, SEX_MAP
 import joblib
 from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestClassifier
+from sklearn.ensemble import HistGradientBoostingClassifier
 from sklearn.metrics import accuracy_score
 
+# 訓練用に読み込むレース結果の列の型
+# 整数の列はスクレイパーと同じ RESULT_DTYPES を使う (単勝人気 'popular' は読み込まない)
+# 小数の列は訓練にしか使わないので、メモリを減らすために float32 にする
+TRAINING_DTYPES = {
+    **{column: dtype for column, dtype in RESULT_DTYPES.items() if column != "popular"},
+    "jockey_weight": "float32",
+    "sex_age": "category",
+}
+
+# 前処理済みデータ(Parquetファイル)の保存先
+PROCESSED_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+# 前処理の内容 (preprocess_data) を変えたときは、この数字を1つ増やす
+# 保存済みの前処理済みデータが使われなくなり、新しい前処理で作り直される
+PREPROCESS_VERSION = 1
+
 
 def load_data():
     """
-    データベースから全テーブルのデータを読み込み、一つのDataFrameに結合して返す関数
+    データベースからレース結果と騎手の成績を結合して読み込み、DataFrameとして返す関数
     """
     print("データベースからデータを読み込んでいます...")
     with app.app_context():
         # SQLAlchemyのエンジンを使って、Pandasで直接SQLクエリを実行
         engine = db.engine
 
-        # 各テーブルをPandas DataFrameとして読み込む
-        results_df = pd.read_sql_table("results", engine)
-        races_df = pd.read_sql_table("races", engine).rename(
-            columns={"id": "race_id", "name": "race_name"}
-        )
-        horses_df = pd.read_sql_table("horses", engine).rename(
-            columns={"id": "horse_id", "name": "horse_name"}
-        )
-        jockeys_df = pd.read_sql_table("jockeys", engine).rename(
-            columns={"id": "jockey_id", "name": "jockey_name"}
-        )
-
-        # テーブルを結合(マージ)していく
-        # 1. results と races を 'race_id' で結合
-        merged_df = pd.merge(results_df, races_df, on="race_id")
-        # 2. horses を 'horse_id' で結合
-        merged_df = pd.merge(merged_df, horses_df, on="horse_id")
-        # 3. jockeys を 'jockey_id' で結合
-        merged_df = pd.merge(merged_df, jockeys_df, on="jockey_id")
-
-        # 不要になった外部キーカラムと主キーを削除
-        merged_df = merged_df.drop(
-            columns=["id", "race_id", "horse_id"]
-        )  # jockey_idは残す
+        # レース結果と騎手の成績をデータベース側で結合(JOIN)し、
+        # 訓練に使う列だけを1回のSQLで読み込む
+        # (テーブルごとに全件読み込んでからPandasで結合すると、途中の大きなDataFrameが
+        #  何度も作られるため)
+        # レース名・馬名・単勝人気など、訓練に使わない列はここで読み込まない
+        query = select(
+            Result.rank,
+            Result.waku,
+            Result.umaban,
+            Result.jockey_weight,
+            Result.horse_weight,
+            Result.sex_age,
+            Jockey.win_rate,
+            Jockey.place_rate,
+            Jockey.show_rate,
+        ).join(Jockey, Result.jockey_id == Jockey.id)
+
+        # 結合・訓練で使うメモリを減らすため、結果の列は値の範囲に合った小さい型にする
+        # ('sex_age' は "牡4" のような少ない種類の値の繰り返しなので、カテゴリ型にする)
+        merged_df = pd.read_sql_query(query, engine, dtype=TRAINING_DTYPES)
 
         print("データの読み込みと結合が完了しました。")
 
@@ -52,47 +68,35 @@ def load_data():
 def preprocess_data(df: pd.DataFrame):
     """
     データの前処理と特徴量エンジ基本的なエンジニアリングを行う関数
+    受け取った df は変更せず、訓練に使う列だけの新しいDataFrameを返す
     """
     print("\nデータの前処理を開始します...")
 
-    df_processed = df.copy()
-
-    # 1. 目的変数の作成 (3着以内に入ったか)
-    df_processed["within_3_rank"] = df_processed["rank"].apply(
-        lambda x: 1 if x <= 3 else 0
-    )
-
-    # 2. 特徴量エンジニアリング
     # 'sex_age' (例: "牡4") を 'sex' と 'age' に分割
-    df_processed["sex"] = df_processed["sex_age"].str[0]
-    df_processed["age"] = df_processed["sex_age"].str[1:].astype(int)
-
-    # 'sex' を数値にエンコード (牡=0, 牝=1, セ=2)
-    sex_map = {"牡": 0, "牝": 1, "セ": 2}
-    df_processed["sex"] = df_processed["sex"].map(sex_map)
-
-    # 騎手の成績データの欠損値を0で埋める
-    df_processed["win_rate"] = df_processed["win_rate"].fillna(0)
-    df_processed["place_rate"] = df_processed["place_rate"].fillna(0)
-    df_processed["show_rate"] = df_processed["show_rate"].fillna(0)
-
-    # 3. 不要な列を削除
-    # 目的変数の元になった 'rank'、処理済みの 'sex_age'
-    # レース前に分からない情報 (単勝人気など)
-    # 今回のモデルでは使わない情報 (名前、日付など)
-    df_processed = df_processed.drop(
-        columns=[
-            "rank",
-            "sex_age",
-            "single_price",
-            "popular",
-            "race_name",
-            "venue",
-            "date",
-            "horse_name",
-            "jockey_name",
-            "jockey_id",  # jockey_idも不要
-        ]
+    # (sex_age はカテゴリ型なので、.str の処理は値の種類ごとに1回だけ行われる)
+    sex_age = df["sex_age"]
+
+    # 訓練に使う列だけを辞書に集めて、新しいDataFrameを1回で作る
+    # (元の df 全体をコピーしてから列を足したり消したりしないので、無駄なコピーが出ない)
+    # 目的変数の元になった 'rank' と、分割済みの 'sex_age' は含めない
+    # (レース前に分からない情報や名前・日付などは、load_data で読み込んでいない)
+    df_processed = pd.DataFrame(
+        {
+            "waku": df["waku"],
+            "umaban": df["umaban"],
+            "jockey_weight": df["jockey_weight"],
+            "horse_weight": df["horse_weight"],
+            # 'sex' を数値にエンコード (牡=0, 牝=1, セ=2)
+            "sex": sex_age.str[0].map(SEX_MAP),
+            "age": sex_age.str[1:].astype("int8"),
+            # 騎手の成績データの欠損値は0で埋める
+            "win_rate": df["win_rate"].fillna(0),
+            "place_rate": df["place_rate"].fillna(0),
+            "show_rate": df["show_rate"].fillna(0),
+            # 目的変数 (3着以内に入ったか)
+            # .apply で1行ずつ関数を呼ばずに、列全体をまとめて比較して 1/0 にする
+            "within_3_rank": (df["rank"] <= 3).astype("int8"),
+        }
     )
 
     # 欠損値を含む行を削除 (今回は'sex'をmapした際に発生する可能性)
@@ -102,6 +106,59 @@ def preprocess_data(df: pd.DataFrame):
     return df_processed
 
 
+def get_data_signature() -> str:
+    """
+    データベースの内容や前処理が変わったかを判定するための、短い文字列(ハッシュ)を作る関数
+    レース結果・騎手が追加されたときや、前処理・特徴量を変えたときに値が変わる
+    """
+    with app.app_context():
+        result_count, max_result_id = db.session.execute(
+            select(func.count(Result.id), func.max(Result.id))
+        ).one()
+        jockey_count = db.session.scalar(select(func.count(Jockey.id)))
+    key = (
+        f"{result_count}:{max_result_id}:{jockey_count}"
+        f":{PREPROCESS_VERSION}:{','.join(MODEL_FEATURES)}"
+    )
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def load_processed_data() -> pd.DataFrame:
+    """
+    前処理済みのデータを返す関数
+    データベースの内容が前回から変わっていなければ、保存しておいたParquetファイルを
+    読み込むだけで済ませ、load_data と preprocess_data を省略する
+    """
+    cache_path = os.path.join(
+        PROCESSED_CACHE_DIR, f"processed_{get_data_signature()}.parquet"
+    )
+    if os.path.exists(cache_path):
+        print(f"前処理済みデータを '{cache_path}' から読み込みます。")
+        return pd.read_parquet(cache_path)
+
+    # データの読み込みと前処理
+    processed_data = preprocess_data(load_data())
+
+    try:
+        os.makedirs(PROCESSED_CACHE_DIR, exist_ok=True)
+        processed_data.to_parquet(cache_path, compression="zstd")
+        print(f"前処理済みデータを '{cache_path}' に保存しました。")
+    except ImportError:
+        print("pyarrow がないため、前処理済みデータの保存を省略します。")
+    else:
+        # 古い前処理済みデータはもう使われないので、たまり続けないように削除する
+        for name in os.listdir(PROCESSED_CACHE_DIR):
+            path = os.path.join(PROCESSED_CACHE_DIR, name)
+            if (
+                name.startswith("processed_")
+                and name.endswith(".parquet")
+                and path != cache_path
+            ):
+                os.remove(path)
+
+    return processed_data
+
+
 def train_and_evaluate_model(df: pd.DataFrame):
     """
     データセットを受け取り、モデルの訓練、評価、保存を行う関数
@@ -114,15 +171,19 @@ def train_and_evaluate_model(df: pd.DataFrame):
 
     # 特徴量のカラムの順番を、予測時と完全に一致させる
     print("特徴量のカラムを予測時と一致するように並び替えます...")
-    X = X[model_features]
+    X = X[list(MODEL_FEATURES)]
 
     # データを訓練用とテスト用に分割 (テストデータ20%, 乱数シード42)
     X_train, X_test, y_train, y_test = train_test_split(
         X, y, test_size=0.2, random_state=42
     )
 
-    # モデルの選択 (ランダムフォレスト)
-    model = RandomForestClassifier(n_estimators=100, random_state=42)
+    # モデルの選択 (ヒストグラム型の勾配ブースティング)
+    # 特徴量の値を256段階にまとめて分岐を探すので、ランダムフォレストより訓練が速く、
+    # 保存したモデルのファイルも小さくなる (訓練は自動で複数のCPUコアを使う)
+    model = HistGradientBoostingClassifier(
+        max_iter=300, learning_rate=0.05, max_leaf_nodes=63, random_state=42
+    )
 
     # モデルの訓練
     print("モデルを訓練中...")
@@ -139,21 +200,65 @@ def train_and_evaluate_model(df: pd.DataFrame):
 
     # 訓練済みモデルの保存
     model_path = "race_prediction_model.pkl"
-    joblib.dump(model, model_path)
+    # API側でメモリマップ読み込み(mmap_mode)できるように、圧縮せずに保存する
+    # 動いているAPIは今のファイルをメモリマップしているので、上書きせずに
+    # 同じフォルダの一時ファイルに書いてから os.replace で置き換える
+    # (置き換え前のファイルは、APIが使い終わるまで中身が変わらずに残る)
+    tmp_path = model_path + ".tmp"
+    joblib.dump(model, tmp_path, compress=0)
+    os.replace(tmp_path, model_path)
     print(f"訓練済みモデルを '{model_path}' に保存しました。")
 
+    # 高速に予測できるように、ONNX形式でも保存する
+    export_onnx_model(model, "race_prediction_model.onnx")
+
     return model
 
 
+def export_onnx_model(model, onnx_path: str):
+    """
+    訓練済みモデルをONNX形式に変換して保存する関数
+    APIはこのファイルがあれば ONNX Runtime を使って高速に予測する
+    """
+    # 古いONNXファイルが残っていると新しいモデルと結果がずれるので、変換の前に削除する
+    if os.path.exists(onnx_path):
+        os.remove(onnx_path)
+
+    try:
+        from skl2onnx import convert_sklearn
+        from skl2onnx.common.data_types import FloatTensorType
+    except ImportError:
+        print("skl2onnx がインストールされていないため、ONNX形式での保存を省略します。")
+        return
+
+    # 入力は「特徴量の数だけ列があるfloat32の配列」であることを指定する
+    initial_types = [("X", FloatTensorType([None, len(MODEL_FEATURES)]))]
+    try:
+        # zipmap=False にすると、確率が辞書のリストではなく配列として出力される
+        onnx_model = convert_sklearn(
+            model, initial_types=initial_types, options={id(model): {"zipmap": False}}
+        )
+        # APIが書きかけのファイルを読まないように、一時ファイルから置き換える
+        tmp_path = onnx_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(onnx_model.SerializeToString())
+        os.replace(tmp_path, onnx_path)
+    except Exception as e:
+        # 変換できなくても、APIは保存済みのscikit-learnのモデルで予測できる
+        print(f"ONNX形式への変換に失敗したため、保存を省略します: {e}")
+        # 書きかけのファイルが残らないように削除する
+        if os.path.exists(onnx_path + ".tmp"):
+            os.remove(onnx_path + ".tmp")
+        return
+    print(f"ONNX形式のモデルを '{onnx_path}' に保存しました。")
+
+
 def main():
     """
     モデルの訓練と評価を実行するメイン関数
     """
-    # ステップ1: データの読み込み
-    all_data = load_data()
-
-    # ステップ2: データの前処理
-    processed_data = preprocess_data(all_data)
+    # ステップ1・2: データの読み込みと前処理 (DBが前回と同じなら保存済みのものを使う)
+    processed_data = load_processed_data()
 
     print("\n--- 前処理後のデータサンプル ---")
     print(processed_data.head())